@@ -1,11 +1,23 @@
 import csv
+import functools
 import os
+import re
+import sqlite3
+import struct
+import threading
+import time
 import requests
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
 from pathlib import Path
-from PIL import Image
-from io import BytesIO
+from urllib.parse import urldefrag
 from tqdm import tqdm
 
+try:
+    import ahocorasick
+except ImportError:  # falls back to a compiled regex trie
+    ahocorasick = None
+
 import sys
 csv.field_size_limit(sys.maxsize)
 
@@ -19,13 +31,16 @@ OUTPUT_DIR.mkdir(exist_ok=True)
 
 LOG_FILE = OUTPUT_DIR / "cleaning_log.csv"
 STATS_FILE = OUTPUT_DIR / "cleaning_stats.csv"
+LOG_BUFFER_SIZE = 1 << 20  # 1 MiB
+IMAGE_CACHE_FILE = OUTPUT_DIR / ".img_cache.sqlite"
+IMAGE_CACHE_TTL = 86400  # s — younger entries are trusted without revalidation
 
 BUG_KEYWORDS = [
    # Generic bug indicators
     "bug", "fix", "error", "fail", "failure", "issue", "problem", 
     "broken", "incorrect", "wrong", "unexpected", "missing", 
     "lost", "typo", "properly", "failing", "failed", "does not work", 
-    "doesn't work", "not working"
+    "doesn't work", "not working",
     # Translation-specific bugs
     "not translated", "wrong translation",  "missing translation", 
     "mistranslation",  "translation missing"
@@ -41,48 +56,321 @@ SEARCH_TERMS = [
 
 MIN_IMAGE_SIZE = 80  # px
 
+# Same pattern mine_issues.py uses to collect the URLs
+IMAGE_URL_RE = re.compile(r'https?://[^\s")]+?\.(?:png|jpg|jpeg|gif|webp)', re.IGNORECASE)
+IMAGE_HEADER_BYTES = 2048  # chunk size; PNG/GIF/WebP fit in the first one
+IMAGE_MAX_HEADER_BYTES = 256 * 1024  # JPEG metadata can push SOF further out
+IMAGE_WORKERS = 32
+ROW_WORKERS = 64
+IMAGE_BATCH_ROWS = 1024  # rows held in memory while their images are checked
+
+# Shared HTTP session + thread pool for image checks
+SESSION = requests.Session()
+_adapter = HTTPAdapter(pool_connections=64, pool_maxsize=64)
+SESSION.mount("http://", _adapter)
+SESSION.mount("https://", _adapter)
+
+IMAGE_POOL = ThreadPoolExecutor(max_workers=IMAGE_WORKERS)
+ROW_POOL = ThreadPoolExecutor(max_workers=ROW_WORKERS)
+
 
 # ---------------------------
 # HELPERS
 # ---------------------------
 
-def contains_bug_keyword(text):
-    if not text:
-        return False
-    t = text.lower()
-    return any(k in t for k in BUG_KEYWORDS)
+def trie_regex(keywords):
+    """
+    Builds one regex alternation shaped like a trie of the keywords,
+    e.g. ["fail", "failed", "failure"] → fail(?:ed|ure)?
+    """
+    trie = {}
+    for k in keywords:
+        node = trie
+        for ch in k.lower():
+            node = node.setdefault(ch, {})
+        node[""] = {}
+
+    def to_pattern(node):
+        optional = "" in node
+        branches = [re.escape(ch) + to_pattern(child) for ch, child in node.items() if ch]
+        if not branches:
+            return ""
+        if len(branches) == 1 and not optional:
+            return branches[0]
+        return "(?:" + "|".join(branches) + ")" + ("?" if optional else "")
+
+    return to_pattern(trie)
+
+
+def build_keyword_scanner(bug_keywords, search_terms):
+    """
+    Returns a function that scans a lowercased text once and tells
+    (has_bug_keyword, has_search_term). Uses a single Aho-Corasick
+    automaton when pyahocorasick is installed.
+    """
+    if ahocorasick is None:
+        bug_re = re.compile(trie_regex(bug_keywords))
+        term_re = re.compile(trie_regex(search_terms))
+        return lambda t: (bug_re.search(t) is not None, term_re.search(t) is not None)
+
+    # Some keywords are in both lists
+    flags = {}
+    for k in bug_keywords:
+        flags[k.lower()] = (True, False)
+    for k in search_terms:
+        is_bug, _ = flags.get(k.lower(), (False, False))
+        flags[k.lower()] = (is_bug, True)
+
+    automaton = ahocorasick.Automaton()
+    for k, f in flags.items():
+        automaton.add_word(k, f)
+    automaton.make_automaton()
+
+    def scan(t):
+        has_bug = has_term = False
+        for _, (is_bug, is_term) in automaton.iter(t):
+            has_bug = has_bug or is_bug
+            has_term = has_term or is_term
+            if has_bug and has_term:
+                break
+        return has_bug, has_term
+
+    return scan
+
+
+scan_keywords = build_keyword_scanner(BUG_KEYWORDS, SEARCH_TERMS)
+
+
+def normalize_url(url):
+    return urldefrag(url.strip())[0]
 
 
-def contains_valid_search_term(text):
-    if not text:
-        return False
-    t = text.lower()
-    return any(term in t for term in SEARCH_TERMS)
+# ---------------------------
+# IMAGE CACHE
+# ---------------------------
+
+_cache_conn = None
+_cache_lock = threading.Lock()
+
+
+def _image_cache():
+    """Opens the on-disk image cache lazily (one connection per process)."""
+    global _cache_conn
+    if _cache_conn is None:
+        _cache_conn = sqlite3.connect(IMAGE_CACHE_FILE, timeout=30, check_same_thread=False)
+        _cache_conn.row_factory = sqlite3.Row
+        _cache_conn.execute(
+            """CREATE TABLE IF NOT EXISTS images (
+                url TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                valid INTEGER,
+                width INTEGER,
+                height INTEGER,
+                checked_at REAL
+            )"""
+        )
+        _cache_conn.commit()
+    return _cache_conn
 
 
-def image_is_valid(url):
+def cache_get(url):
+    """Cached entry for url, or None. Cache errors count as a miss."""
+    try:
+        with _cache_lock:
+            row = _image_cache().execute(
+                "SELECT * FROM images WHERE url = ?", (url,)
+            ).fetchone()
+    except sqlite3.Error:
+        return None
+    return dict(row) if row else None
+
+
+def cache_put(url, entry):
+    """Stores entry for url. Cache errors (e.g. a locked database) skip the write."""
     try:
-        resp = requests.get(url, timeout=10)
+        with _cache_lock:
+            conn = _image_cache()
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (url, entry["etag"], entry["last_modified"], int(entry["valid"]),
+                     entry["width"], entry["height"], time.time())
+                )
+                conn.commit()
+            except sqlite3.Error:
+                conn.rollback()
+                raise
+    except sqlite3.Error:
+        pass
+
+
+# ---------------------------
+# IMAGE CHECKS
+# ---------------------------
+
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+JPEG_STANDALONE_MARKERS = {0x01, 0xD0, 0xD1, 0xD2, 0xD3, 0xD4, 0xD5, 0xD6, 0xD7, 0xD8}
+
+
+def _jpeg_dimensions(data):
+    i = 2
+    while i + 4 <= len(data):
+        if data[i] != 0xFF:
+            raise ValueError("corrupt JPEG")
+        marker = data[i + 1]
+        if marker == 0xFF:  # fill byte
+            i += 1
+            continue
+        if marker in JPEG_STANDALONE_MARKERS:
+            i += 2
+            continue
+        if marker in JPEG_SOF_MARKERS:
+            if i + 9 > len(data):
+                return None
+            h, w = struct.unpack(">HH", data[i + 5:i + 9])
+            return w, h
+        (length,) = struct.unpack(">H", data[i + 2:i + 4])
+        i += 2 + length
+    return None
+
+
+def image_dimensions(data):
+    """
+    Reads (width, height) from the first bytes of a PNG, JPEG, GIF or WebP.
+    Returns None if more bytes are needed; raises ValueError for other formats.
+    """
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        if len(data) < 24:
+            return None
+        return struct.unpack(">II", data[16:24])
+
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        if len(data) < 10:
+            return None
+        return struct.unpack("<HH", data[6:10])
+
+    if data.startswith(b"\xff\xd8"):
+        return _jpeg_dimensions(data)
+
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        if len(data) < 30:
+            return None
+        chunk = data[12:16]
+        if chunk == b"VP8 ":
+            w, h = struct.unpack("<HH", data[26:30])
+            return w & 0x3FFF, h & 0x3FFF
+        if chunk == b"VP8L":
+            (bits,) = struct.unpack("<I", data[21:25])
+            return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+        if chunk == b"VP8X":
+            w = int.from_bytes(data[24:27], "little") + 1
+            h = int.from_bytes(data[27:30], "little") + 1
+            return w, h
+        raise ValueError("unknown WebP chunk")
+
+    if len(data) < 12:
+        return None
+    raise ValueError("unsupported image format")
+
+
+def fetch_image_info(url, cached=None):
+    """
+    Conditional GET reading only as many bytes as the image header needs.
+    Returns a cache entry, or None if the fetch failed.
+    """
+    headers = {}
+    if cached and cached["etag"]:
+        headers["If-None-Match"] = cached["etag"]
+    if cached and cached["last_modified"]:
+        headers["If-Modified-Since"] = cached["last_modified"]
+
+    size = None
+    with SESSION.get(url, headers=headers, stream=True, timeout=10) as resp:
+        if resp.status_code == 304 and cached:
+            return cached
         if resp.status_code != 200:
-            return False
-        img = Image.open(BytesIO(resp.content))
-        w, h = img.size
-        return w > MIN_IMAGE_SIZE and h > MIN_IMAGE_SIZE
+            return None
+        etag = resp.headers.get("ETag")
+        last_modified = resp.headers.get("Last-Modified")
+
+        data = bytearray()
+        try:
+            for chunk in resp.iter_content(IMAGE_HEADER_BYTES):
+                data += chunk
+                size = image_dimensions(data)
+                if size or len(data) >= IMAGE_MAX_HEADER_BYTES:
+                    break
+        except (ValueError, struct.error):
+            size = None
+
+    w, h = size or (0, 0)
+    return {
+        "etag": etag,
+        "last_modified": last_modified,
+        "valid": w > MIN_IMAGE_SIZE and h > MIN_IMAGE_SIZE,
+        "width": w,
+        "height": h
+    }
+
+
+@functools.lru_cache(maxsize=50000)
+def image_is_valid(url):
+    url = normalize_url(url)
+    cached = cache_get(url)
+    if cached and time.time() - cached["checked_at"] < IMAGE_CACHE_TTL:
+        return bool(cached["valid"])
+
+    try:
+        entry = fetch_image_info(url, cached)
     except Exception:
         return False
 
+    if entry is None:
+        return False
+
+    cache_put(url, entry)
+    return bool(entry["valid"])
+
 
 def any_valid_image(urls_str):
     if not urls_str:
         return False
-    urls = [u.strip() for u in urls_str.split(",") if u.strip()]
-    return any(image_is_valid(url) for url in urls)
+    urls = [u for u in (u.strip() for u in urls_str.split(",")) if IMAGE_URL_RE.fullmatch(u)]
+    if not urls:
+        return False
+
+    # Check all URLs concurrently, stop at the first valid one
+    futures = [IMAGE_POOL.submit(image_is_valid, url) for url in urls]
+    try:
+        return any(f.result() for f in as_completed(futures))
+    finally:
+        for f in futures:
+            f.cancel()
 
 
 # ---------------------------
 # MAIN CLEANING
 # ---------------------------
 
+def new_counters():
+    return {
+        "total_scanned": 0,
+        "kept": 0,
+        "removed_bug_keyword": 0,
+        "removed_search_term": 0,
+        "removed_image": 0
+    }
+
+
+COUNTER_FOR_VERDICT = {
+    "bug_keyword": "removed_bug_keyword",
+    "search_term": "removed_search_term",
+    "image": "removed_image",
+    "kept": "kept"
+}
+
+
 def save_stats(counters):
     """Overwrites the stats file with current cumulative counters."""
     with open(STATS_FILE, "w", newline="", encoding="utf-8") as f:
@@ -91,94 +379,95 @@ def save_stats(counters):
         writer.writerow(counters)
 
 
-def process_single_csv(csv_file: Path, log_writer, counters):
+def check_image_batch(batch, csv_file, counters, log_rows, writer, image_bar):
+    """
+    Runs the image rule concurrently for the pending rows of a batch, then
+    records every row of the batch in input order (counters, log, cleaned CSV).
+    batch holds (row, removed_by) pairs; removed_by is None while pending.
+    """
+    urls = [row.get("image_urls", "") for row, removed_by in batch if removed_by is None]
+    image_results = ROW_POOL.map(any_valid_image, urls)
+
+    for row, removed_by in batch:
+        if removed_by is None:
+            removed_by = "kept" if next(image_results) else "image"
+            image_bar.update()
+
+        counters[COUNTER_FOR_VERDICT[removed_by]] += 1
+        log_rows.append({
+            "issue_id": row.get("issue_id", ""),
+            "csv_file": csv_file.name,
+            "removed_by": removed_by,
+            "title": row.get("title") or ""
+        })
+
+        # If passed all checks → keep (body was already dropped)
+        if removed_by == "kept":
+            writer.writerow(row)
+
+
+def process_single_csv(csv_file: Path):
+    """
+    Cleans one CSV and writes its cleaned_*.csv.
+    Runs in a worker process, so counters and log rows are returned
+    to the parent instead of being written to shared state.
+    """
     print(f"\n➡️ Processing {csv_file.name}")
 
     cleaned_path = OUTPUT_DIR / f"cleaned_{csv_file.name}"
-    valid_rows = []
+    counters = new_counters()
+    log_rows = []
+    batch = []
     total_before = 0
 
-    with open(csv_file, encoding="utf-8") as f:
-        reader = list(csv.DictReader(f))
+    with open(csv_file, encoding="utf-8") as f, \
+            open(cleaned_path, "w", newline="", encoding="utf-8") as out, \
+            tqdm(desc=f"Images {csv_file.name}", unit="issue") as image_bar:
+        reader = csv.DictReader(f)
+        fieldnames = [c for c in (reader.fieldnames or []) if c != "body"]
+        writer = csv.DictWriter(out, fieldnames=fieldnames, extrasaction="ignore")
+        writer.writeheader()
 
         for row in tqdm(reader, desc=f"Cleaning {csv_file.name}", unit="issue"):
             total_before += 1
             counters["total_scanned"] += 1
 
             issue_id = row.get("issue_id", "")
-            title = row.get("title", "")
-            body = row.get("body", "")
-            labels = row.get("labels", "")
+            title = row.get("title") or ""
+            body = row.pop("body", None) or ""  # never kept on the row
+            labels = row.get("labels") or ""
 
-            combined_text = f"{title} {body} {labels}".lower()
+            combined_text = " ".join((title, body, labels)).lower()
+            has_bug_keyword, has_search_term = scan_keywords(combined_text)
 
             # RULE 1 — bug keyword
-            if not contains_bug_keyword(combined_text):
-                counters["removed_bug_keyword"] += 1
-                log_writer.writerow({
-                    "issue_id": issue_id,
-                    "csv_file": csv_file.name,
-                    "removed_by": "bug_keyword",
-                    "title": title
-                })
-                save_stats(counters)
-                continue
+            if not has_bug_keyword:
+                batch.append(({"issue_id": issue_id, "title": title}, "bug_keyword"))
 
             # RULE 2 — search term
-            if not contains_valid_search_term(combined_text):
-                counters["removed_search_term"] += 1
-                log_writer.writerow({
-                    "issue_id": issue_id,
-                    "csv_file": csv_file.name,
-                    "removed_by": "search_term",
-                    "title": title
-                })
-                save_stats(counters)
-                continue
-
-            # RULE 3 — valid image
-            urls = row.get("image_urls", "")
-            if not any_valid_image(urls):
-                counters["removed_image"] += 1
-                log_writer.writerow({
-                    "issue_id": issue_id,
-                    "csv_file": csv_file.name,
-                    "removed_by": "image",
-                    "title": title
-                })
-                save_stats(counters)
-                continue
-
-            # If passed all checks → keep
-            counters["kept"] += 1
-            log_writer.writerow({
-                "issue_id": issue_id,
-                "csv_file": csv_file.name,
-                "removed_by": "kept",
-                "title": title
-            })
+            elif not has_search_term:
+                batch.append(({"issue_id": issue_id, "title": title}, "search_term"))
 
-            valid_rows.append(row)
-            save_stats(counters)
+            # RULE 3 — valid image, checked once the batch is full
+            else:
+                batch.append((row, None))
 
-    print(f"🧹 {len(valid_rows)} valid issues (from {total_before}) in {csv_file.name}")
+            if len(batch) >= IMAGE_BATCH_ROWS:
+                check_image_batch(batch, csv_file, counters, log_rows, writer, image_bar)
+                batch = []
 
-    # Save cleaned CSV
-    if valid_rows:
-        fieldnames = [c for c in valid_rows[0].keys() if c != "body"]
+        check_image_batch(batch, csv_file, counters, log_rows, writer, image_bar)
 
-        with open(cleaned_path, "w", newline="", encoding="utf-8") as f:
-            writer = csv.DictWriter(f, fieldnames=fieldnames)
-            writer.writeheader()
-
-            for row in valid_rows:
-                row.pop("body", None)
-                writer.writerow(row)
+    print(f"🧹 {counters['kept']} valid issues (from {total_before}) in {csv_file.name}")
 
+    if counters["kept"]:
         print(f"💾 Saved cleaned file: {cleaned_path.name}")
     else:
+        cleaned_path.unlink()
         print(f"⚠️ No valid issues for {csv_file.name}")
 
+    return counters, log_rows
+
 
 def main():
     csv_files = sorted(INPUT_DIR.glob("*.csv"))
@@ -188,23 +477,21 @@ def main():
 
     print(f"📂 Found {len(csv_files)} CSV files")
 
-    # counters
-    counters = {
-        "total_scanned": 0,
-        "kept": 0,
-        "removed_bug_keyword": 0,
-        "removed_search_term": 0,
-        "removed_image": 0
-    }
+    counters = new_counters()
 
-    with open(LOG_FILE, "w", newline="", encoding="utf-8") as lf:
+    with open(LOG_FILE, "w", newline="", encoding="utf-8", buffering=LOG_BUFFER_SIZE) as lf:
         log_writer = csv.DictWriter(
             lf, fieldnames=["issue_id", "csv_file", "removed_by", "title"]
         )
         log_writer.writeheader()
 
-        for csv_file in csv_files:
-            process_single_csv(csv_file, log_writer, counters)
+        # One worker per file; the parent owns the log and the stats
+        with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+            for file_counters, log_rows in executor.map(process_single_csv, csv_files):
+                for key, value in file_counters.items():
+                    counters[key] += value
+                log_writer.writerows(log_rows)
+                save_stats(counters)
 
     print(f"\n📄 Log saved at: {LOG_FILE}")
     print(f"📊 Stats saved at: {STATS_FILE}")
@@ -1,15 +1,31 @@
 import requests
 import csv
 import json
+import math
 import re
 import os
-from time import sleep
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from requests.adapters import HTTPAdapter
+from time import sleep, time
+from calendar import monthrange
 from datetime import datetime, timedelta
 from collections import Counter
 from dotenv import load_dotenv
 from pathlib import Path
 import argparse
 
+try:
+    import ahocorasick
+except ImportError:  # sem pyahocorasick usa a busca simples por substring
+    ahocorasick = None
+
+try:
+    import orjson
+except ImportError:  # sem orjson usa o json da stdlib
+    orjson = None
+
 # 
 # EXEMPLO:
 # python mine_issues.py --start-year 2020 --end-year 2025 --interval-days 30 --max-pages 1 --per-page 10
@@ -23,6 +39,11 @@ load_dotenv()  # Load .env variables
 GITHUB_TOKEN = os.environ.get("GITHUB_TOKEN")
 HEADERS = {"Authorization": f"token {GITHUB_TOKEN}"} if GITHUB_TOKEN else {}
 
+MAX_CONCURRENT_REQUESTS = 20
+MAX_RETRIES = 3
+SEARCH_RESULTS_CAP = 1000  # a API de busca não retorna além disso
+RATE_LIMIT_FALLBACK_WAIT = 60  # s — espera do GitHub quando não há Retry-After/Reset
+
 SEARCH_TERMS = [
     "i18n", "l10n", "localization", "internationalization", "translation",
     "missing translation", "mistranslation", "locale", "date format",
@@ -33,6 +54,7 @@ SEARCH_TERMS = [
 
 CSV_OUTPUT_TEMPLATE = "l10n_i18n_issues_{year}_Q{quarter}.csv"
 JSON_OUTPUT_TEMPLATE = "l10n_i18n_issues_{year}_Q{quarter}.json"
+DONE_QUARTERS_FILE = ".done_quarters.txt"
 
 BUG_TYPES = {
     "truncation": ["truncate", "truncated", "cut off", "clipping", "overflow"],
@@ -50,35 +72,171 @@ RESULTS_PER_PAGE = 10
 START_YEAR = 2025
 END_YEAR = 2015
 
+# Pega apenas URLs terminando com png, jpg, jpeg, gif ou webp
+IMAGE_URL_RE = re.compile(r'https?://[^\s")]+?\.(?:png|jpg|jpeg|gif|webp)', re.IGNORECASE)
+
+SEARCH_TERM_TAG = "search_term"
+
+# IDs de issues já processadas nesta execução: uma issue retornada por
+# vários termos só tem os comentários buscados uma vez
+SEEN_IDS = set()
+
+
+# -----------------------------
+# HTTP
+# -----------------------------
+SESSION = requests.Session()
+SESSION.headers.update(HEADERS)
+_adapter = HTTPAdapter(pool_connections=MAX_CONCURRENT_REQUESTS, pool_maxsize=MAX_CONCURRENT_REQUESTS)
+SESSION.mount("https://", _adapter)
+
+# O tamanho do pool limita as requisições simultâneas
+POOL = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS)
+
+
+# Segue os headers X-RateLimit-Remaining / X-RateLimit-Reset do GitHub e
+# bloqueia todos os workers quando a janela atual se esgota. Um 403/429 de
+# rate limit (primário ou secundário) bloqueia até o Retry-After, o reset
+# ou RATE_LIMIT_FALLBACK_WAIT segundos.
+class RateLimiter:
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.remaining = None
+        self.reset_at = 0
+
+    def acquire(self):
+        with self.lock:
+            if self.remaining is not None and self.remaining <= 0:
+                delay = self.reset_at - time()
+                if delay > 0:
+                    print(f"⚠️ {self.name} rate limit reached. Waiting {delay:.0f}s...")
+                    sleep(delay + 1)
+                self.remaining = None
+            elif self.remaining is not None:
+                self.remaining -= 1
+
+    def update(self, response, limited):
+        remaining = response.headers.get("X-RateLimit-Remaining")
+        reset = response.headers.get("X-RateLimit-Reset")
+        retry_after = response.headers.get("Retry-After")
+
+        with self.lock:
+            if remaining is not None:
+                self.remaining = int(remaining)
+            if reset is not None:
+                self.reset_at = int(reset)
+
+            if limited:
+                # Limite primário ou secundário: todos os workers esperam
+                self.remaining = 0
+                if retry_after is not None:
+                    self.reset_at = time() + int(retry_after)
+                elif remaining != "0" or reset is None:
+                    self.reset_at = time() + RATE_LIMIT_FALLBACK_WAIT
+
+    def is_limited(self, response):
+        if response.status_code == 429:
+            return True
+        if response.status_code != 403:
+            return False
+        if "Retry-After" in response.headers or response.headers.get("X-RateLimit-Remaining") == "0":
+            return True
+
+        # O limite secundário só aparece na mensagem do corpo
+        try:
+            message = response.json().get("message") or ""
+        except (ValueError, AttributeError):
+            message = ""
+        return "rate limit" in message.lower()
+
+
+SEARCH_LIMITER = RateLimiter("Search")
+CORE_LIMITER = RateLimiter("Core")
+
+
+# GET respeitando o rate limit; tenta de novo depois que a janela reinicia.
+# Um 403 que não é de rate limit (ex.: sem permissão) volta na hora.
+def github_get(url, limiter, params=None):
+    for _ in range(MAX_RETRIES):
+        limiter.acquire()
+        response = SESSION.get(url, params=params, timeout=30)
+        limited = limiter.is_limited(response)
+        if response.status_code == 403 and not limited:
+            break
+        limiter.update(response, limited)
+        if not limited:
+            break
+    return response
+
 
 # -----------------------------
 # FUNÇÕES
 # -----------------------------
 def extract_image_urls(text):
-    if not text:
+    # Toda URL tem "://" — evita rodar o regex em textos sem links
+    if not text or "://" not in text:
         return []
-    # Pega apenas URLs terminando com png, jpg, jpeg, gif ou webp
-    pattern = r'https?://[^\s")]+?\.(?:png|jpg|jpeg|gif|webp)'
-    matches = re.findall(pattern, text, flags=re.IGNORECASE)
-    return matches
+    return IMAGE_URL_RE.findall(text)
+
+
 
+# Um único automaton para todas as palavras de BUG_TYPES e SEARCH_TERMS.
+# Cada palavra aponta para os pares (categoria, palavra) a que pertence,
+# já que algumas aparecem em mais de uma lista.
+def build_keyword_automaton():
+    if ahocorasick is None:
+        return None
 
+    tags = {}
+    for bug_type, keywords in BUG_TYPES.items():
+        for k in keywords:
+            tags.setdefault(k.lower(), []).append((bug_type, k))
+    for t in SEARCH_TERMS:
+        tags.setdefault(t.lower(), []).append((SEARCH_TERM_TAG, t))
 
-def detect_bug_types(title, body):
+    automaton = ahocorasick.Automaton()
+    for k, pairs in tags.items():
+        automaton.add_word(k, pairs)
+    automaton.make_automaton()
+    return automaton
+
+
+KEYWORD_AC = build_keyword_automaton()
+
+# Versões em minúsculas, calculadas uma vez, para o caminho sem automaton
+BUG_TYPES_LOWER = {bug_type: [k.lower() for k in keywords] for bug_type, keywords in BUG_TYPES.items()}
+SEARCH_TERMS_LOWER = [(t, t.lower()) for t in SEARCH_TERMS]
+
+
+# Retorna (bug_types, search_terms_found) com uma única varredura do texto
+def detect_keywords(title, body, term):
     text = f"{title or ''} {body or ''}".lower()
-    return [bug_type for bug_type, keywords in BUG_TYPES.items() if any(k in text for k in keywords)]
 
+    if KEYWORD_AC is None:
+        hits = {bug_type for bug_type, keywords in BUG_TYPES_LOWER.items()
+                if any(k in text for k in keywords)}
+        terms = {t for t, t_lower in SEARCH_TERMS_LOWER if t_lower in text}
+    else:
+        hits, terms = set(), set()
+        for _, pairs in KEYWORD_AC.iter(text):
+            for category, keyword in pairs:
+                if category == SEARCH_TERM_TAG:
+                    terms.add(keyword)
+                else:
+                    hits.add(category)
 
-def detect_search_terms(text, term):
-    found_terms = [t for t in SEARCH_TERMS if t.lower() in (text or "").lower()]
+    # Mantém a ordem das listas de configuração
+    bug_types = [bug_type for bug_type in BUG_TYPES if bug_type in hits]
+    found_terms = [t for t in SEARCH_TERMS if t in terms]
     if term not in found_terms:
         found_terms.append(term)
-    return found_terms
+    return bug_types, found_terms
 
 
 def fetch_issue_comments(comments_url):
     try:
-        response = requests.get(comments_url, headers=HEADERS)
+        response = github_get(comments_url, CORE_LIMITER)
         if response.status_code != 200:
             return []
         comments = response.json()
@@ -90,59 +248,96 @@ def fetch_issue_comments(comments_url):
         return []
 
 
-def fetch_issues_by_date(term, since_date, until_date):
-    issues = []
-    for page in range(1, MAX_PAGES + 1):
-        query = f'{term} in:title,body is:issue created:{since_date}..{until_date}'
-        url = "https://api.github.com/search/issues"
-        params = {"q": query, "page": page, "per_page": RESULTS_PER_PAGE}
-        print(f"  🔎 Fetching page {page} for term '{term}' from {since_date} → {until_date}")
+def fetch_search_page(term, since_date, until_date, page):
+    query = f'{term} in:title,body is:issue created:{since_date}..{until_date}'
+    url = "https://api.github.com/search/issues"
+    params = {"q": query, "page": page, "per_page": RESULTS_PER_PAGE}
+    print(f"  🔎 Fetching page {page} for term '{term}' from {since_date} → {until_date}")
+
+    try:
+        return github_get(url, SEARCH_LIMITER, params=params)
+    except requests.exceptions.RequestException as e:
+        print(f"⚠️ Connection error: {e}")
+        return None
 
-        try:
-            response = requests.get(url, headers=HEADERS, params=params)
-        except requests.exceptions.RequestException as e:
-            print(f"⚠️ Connection error: {e}")
-            continue
 
-        if response.status_code == 403:
-            print("⚠️ Rate limit reached. Waiting 60s...")
-            sleep(60)
+def fetch_issues_by_date(term, since_date, until_date):
+    fetch_page = partial(fetch_search_page, term, since_date, until_date)
+
+    # A primeira página diz quantas existem; as demais vão em paralelo
+    first = fetch_page(1)
+    responses = [first]
+    first_data = None
+    if first is not None and first.status_code == 200:
+        first_data = first.json()
+        total = min(first_data.get("total_count", 0), SEARCH_RESULTS_CAP)
+        last_page = min(MAX_PAGES, math.ceil(total / RESULTS_PER_PAGE))
+        responses += POOL.map(fetch_page, range(2, last_page + 1))
+
+    items = []
+    for response in responses:
+        if response is None:
             continue
 
         if response.status_code != 200:
             break
 
-        items = response.json().get("items", [])
-        if not items:
+        data = first_data if response is first else response.json()
+        page_items = data.get("items", [])
+        if not page_items:
             break
 
-        for item in items:
-            body = item.get("body") or ""
-            images = extract_image_urls(body)
-            images += fetch_issue_comments(item.get("comments_url"))
-
-            repo_full_name = item["repository_url"].split("repos/")[-1]
-            text = f"{item.get('title', '')} {body}"
-
-            issues.append({
-                "issue_id": item.get("id"),
-                "repo_full": repo_full_name,
-                "repo": repo_full_name.split("/")[-1],
-                "title": item.get("title"),
-                "url": item.get("html_url"),
-                "body": body,
-                "labels": [label["name"] for label in item.get("labels", [])],
-                "image_urls": images,
-                "bug_types": detect_bug_types(item.get("title"), body),
-                "search_terms_found": detect_search_terms(text, term),
-                "created_at": item.get("created_at")
-            })
+        items.extend(page_items)
+
+    # Ignora issues já retornadas por outro termo antes de buscar comentários
+    new_items = []
+    for item in items:
+        if item.get("id") in SEEN_IDS:
+            continue
+        SEEN_IDS.add(item.get("id"))
+        new_items.append(item)
+    items = new_items
+
+    comment_images = POOL.map(fetch_issue_comments, [item.get("comments_url") for item in items])
 
-        sleep(1)
+    issues = []
+    for item, images_from_comments in zip(items, comment_images):
+        body = item.get("body") or ""
+        images = extract_image_urls(body)
+        images += images_from_comments
+
+        repo_full_name = item["repository_url"].split("repos/")[-1]
+        bug_types, found_terms = detect_keywords(item.get("title"), body, term)
+
+        issues.append({
+            "issue_id": item.get("id"),
+            "repo_full": repo_full_name,
+            "repo": repo_full_name.split("/")[-1],
+            "title": item.get("title"),
+            "url": item.get("html_url"),
+            "body": body,
+            "labels": [label["name"] for label in item.get("labels", [])],
+            "image_urls": images,
+            "bug_types": bug_types,
+            "search_terms_found": found_terms,
+            "created_at": item.get("created_at")
+        })
 
     return issues
 
 
+def load_done_quarters(filename):
+    if not filename.exists():
+        return set()
+    with open(filename, encoding="utf-8") as f:
+        return {line.strip() for line in f if line.strip()}
+
+
+def mark_quarter_done(filename, quarter_key):
+    with open(filename, "a", encoding="utf-8") as f:
+        f.write(f"{quarter_key}\n")
+
+
 def save_to_csv(issues, filename):
     keys = [
         "issue_id", "repo_full", "repo", "title", "body", "url",
@@ -190,6 +385,11 @@ def save_to_json(issues, filename, total_collected, search_terms, search_type="d
 
     output = {"summary": summary, "issues": issues}
 
+    if orjson is not None:
+        with open(filename, "wb") as f:
+            f.write(orjson.dumps(output, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
+        return
+
     with open(filename, "w", encoding="utf-8") as f:
         json.dump(output, f, indent=2, ensure_ascii=False)
 
@@ -208,6 +408,8 @@ def main():
     parser.add_argument("--max-pages", "-mp", type=int, default=MAX_PAGES)
     parser.add_argument("--per-page", "-pp", type=int, default=RESULTS_PER_PAGE)
     parser.add_argument("--start-quarter", type=int, default=1)
+    parser.add_argument("--resume", action="store_true",
+                        help=f"skip quarters listed in output/{DONE_QUARTERS_FILE} by previous runs")
 
     args = parser.parse_args()
 
@@ -220,6 +422,11 @@ def main():
     output_dir = Path("output")
     output_dir.mkdir(exist_ok=True)
 
+    done_quarters_path = output_dir / DONE_QUARTERS_FILE
+    done_quarters = load_done_quarters(done_quarters_path)
+    if args.resume and done_quarters:
+        print(f"👀 Skipping {len(done_quarters)} quarters finished in previous runs")
+
     if GITHUB_TOKEN:
         print("🔑 Using GitHub token")
     else:
@@ -246,28 +453,20 @@ def main():
                 continue
 
             q_start = datetime(year, m_start, 1)
-            q_end = datetime(year, m_end, 1)
-
             # último dia do mês final
-            if m_end in [1,3,5,7,8,10,12]:
-                last_day = 31
-            elif m_end == 2:
-                if year % 4 == 0 and (year % 100 != 0 or year % 400 == 0):
-                    last_day = 29
-                else:
-                    last_day = 28
-            else:
-                last_day = 30
-
-            q_end = datetime(year, m_end, last_day)
+            q_end = datetime(year, m_end, monthrange(year, m_end)[1])
 
             if q_start > today:
                 break
 
+            quarter_key = f"{year}_Q{q_index}"
+            if args.resume and quarter_key in done_quarters:
+                print(f"⏭️  Q{q_index} {year} already finished; keeping existing files")
+                continue
+
             print(f"\n🗓️  Processing Q{q_index} ({q_start:%b}–{q_end:%b}) {year}...")
 
             current_start = q_end
-            seen_urls = set()
             quarter_issues = []
 
             while current_start >= q_start:
@@ -278,11 +477,8 @@ def main():
                 until_str = current_end.strftime("%Y-%m-%d")
 
                 for term in SEARCH_TERMS:
-                    issues = fetch_issues_by_date(term, since_str, until_str)
-                    for issue in issues:
-                        if issue["url"] not in seen_urls:
-                            seen_urls.add(issue["url"])
-                            quarter_issues.append(issue)
+                    # fetch_issues_by_date já descarta as issues de outros termos
+                    quarter_issues.extend(fetch_issues_by_date(term, since_str, until_str))
 
                 current_start = interval_start - timedelta(days=1)
 
@@ -299,6 +495,11 @@ def main():
                 search_terms=SEARCH_TERMS
             )
 
+            # Trimestre em andamento ainda pode ganhar issues: não marca
+            if q_end < today and quarter_key not in done_quarters:
+                mark_quarter_done(done_quarters_path, quarter_key)
+                done_quarters.add(quarter_key)
+
             print(f"💾 Saved Q{q_index}: {csv_path}, {json_path}")
 
     print("\n✅ Finished. All files saved in /output")